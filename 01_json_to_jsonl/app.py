@@ -31,9 +31,20 @@ import argparse
 import json
 import os
 import re
-from collections import defaultdict
-from datetime import datetime
-from typing import Any, Dict, Iterable, List, Optional, Tuple
+from collections import defaultdict, namedtuple
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # fall back to stdlib json
+    orjson = None
+
+try:
+    from ciso8601 import parse_datetime as _ciso_parse
+except ImportError:  # optional; datetime.fromisoformat is used instead
+    _ciso_parse = None
 
 
 UNIFIED_KEYS = [
@@ -51,9 +62,63 @@ UNIFIED_KEYS = [
     "advice",
 ]
 
+# One normalized event: a fixed-layout record instead of a dict per event.
+# Field order is the output key order.
+Event = namedtuple("Event", UNIFIED_KEYS)
+
 
 USER_DIR_RE = re.compile(r"^user_(\d+)$")
 TASK_DIR_RE = re.compile(r"^task_(\d+)$")
+DIGITS_RE = re.compile(r"(\d+)")
+
+
+if orjson is not None:
+    _loads = orjson.loads
+
+    def _dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+else:
+    _loads = json.loads
+    # json.dumps() with non-default options builds a new encoder per call;
+    # compact separators match orjson, so output doesn't depend on which is installed
+    _json_encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+    def _dumps(obj: Any) -> bytes:
+        return _json_encode(obj).encode("utf-8")
+
+
+# Files up to this size are read in one go and split; larger ones are
+# scanned in fixed-size chunks so memory stays bounded.
+WHOLE_READ_LIMIT = 64 << 20
+READ_CHUNK_SIZE = 1 << 20
+# Buffer size for file reads/writes (default is 8 KiB).
+IO_BUFFER_SIZE = 1 << 20
+# Output rows are encoded and written this many at a time.
+WRITE_BATCH_SIZE = 4096
+
+
+def iter_raw_lines(path: str) -> Iterator[bytes]:
+    """Yield the lines of a file as bytes (without the trailing newline)."""
+    with open(path, "rb", buffering=IO_BUFFER_SIZE) as f:
+        if os.fstat(f.fileno()).st_size <= WHOLE_READ_LIMIT:
+            yield from f.read().split(b"\n")
+            return
+        # keep the unterminated tail as a list of chunks so a very long line
+        # is joined once instead of being re-copied on every read
+        pending: List[bytes] = []
+        while True:
+            chunk = f.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            cut = chunk.rfind(b"\n")
+            if cut < 0:
+                pending.append(chunk)
+                continue
+            pending.append(chunk[:cut])
+            yield from b"".join(pending).split(b"\n")
+            pending = [chunk[cut + 1:]]
+        if pending:
+            yield b"".join(pending)
 
 
 def to_int_or_none(x: Any) -> Optional[int]:
@@ -73,6 +138,11 @@ def parse_iso_ts(ts: Any) -> Optional[datetime]:
     if not isinstance(ts, str):
         return None
     s = ts.strip()
+    if _ciso_parse is not None:
+        try:
+            return _ciso_parse(s)
+        except ValueError:
+            pass
     try:
         # Handle trailing Z
         if s.endswith("Z"):
@@ -82,21 +152,60 @@ def parse_iso_ts(ts: Any) -> Optional[datetime]:
         return None
 
 
+def ts_sort_key(ts: Any) -> str:
+    """
+    Sort key for ISO-8601 timestamps that avoids building a datetime per event.
+    UTC stamps compare correctly as plain strings once 'Z' is spelled '+00:00'
+    ('+' sorts before '.', so '...:14+00:00' < '...:14.080+00:00').
+    Other offsets are parsed and re-rendered in UTC. Non-strings and strings
+    that don't parse sort first; strings ending in 'Z' / '+00:00' are taken
+    as-is without validation.
+    """
+    if not isinstance(ts, str):
+        return ""
+    s = ts.strip()
+    if s.endswith("Z"):
+        return s[:-1] + "+00:00"
+    if s.endswith("+00:00"):
+        return s
+    dt = parse_iso_ts(s)
+    if dt is None:
+        return ""
+    if dt.tzinfo is not None:
+        try:
+            dt = dt.astimezone(timezone.utc)
+        except OverflowError:
+            # UTC falls outside datetime's range (e.g. 9999-12-31T23:30:00-01:00)
+            return dt.replace(tzinfo=None).isoformat()
+    return dt.isoformat()
+
+
 def pad_user_id(user_id: str) -> str:
     """
     Normalize to 'user_XXX' where XXX is 3+ digits.
     Accepts: 'user_21', 'user_021', '21', 21
     """
     if isinstance(user_id, int):
-        n = user_id
+        return f"user_{user_id:03d}"
+    # raw values may be unhashable (lists etc.), so cache on the str form
+    return _pad_user_str(str(user_id))
+
+
+@lru_cache(maxsize=None)
+def _pad_user_str(s: str) -> str:
+    # common case ('user_021' / '21') needs no regex
+    digits = s[5:] if s.startswith("user_") else s
+    if digits.isascii() and digits.isdigit():
+        n = int(digits)
     else:
-        m = re.search(r"(\d+)", str(user_id))
+        m = DIGITS_RE.search(s)
         n = int(m.group(1)) if m else 0
     return f"user_{n:03d}"
 
 
+@lru_cache(maxsize=None)
 def filename_user_task(user_id: str, task_num: int) -> str:
-    u = re.search(r"(\d+)", user_id)
+    u = DIGITS_RE.search(user_id)
     unum = int(u.group(1)) if u else 0
     return f"user{unum:03d}_task{task_num:03d}.jsonl"
 
@@ -107,20 +216,18 @@ def read_json_or_jsonl(path: str) -> Iterable[Dict[str, Any]]:
     - Else: treat as single JSON object
     """
     if path.lower().endswith(".jsonl"):
-        with open(path, "r", encoding="utf-8") as f:
-            for i, line in enumerate(f, 1):
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    obj = json.loads(line)
-                    if isinstance(obj, dict):
-                        yield obj
-                except json.JSONDecodeError as e:
-                    raise RuntimeError(f"JSONL parse error: {path}:{i}: {e}") from e
+        for i, line in enumerate(iter_raw_lines(path), 1):
+            if not line or line.isspace():
+                continue
+            try:
+                obj = _loads(line)
+                if isinstance(obj, dict):
+                    yield obj
+            except json.JSONDecodeError as e:
+                raise RuntimeError(f"JSONL parse error: {path}:{i}: {e}") from e
     else:
-        with open(path, "r", encoding="utf-8") as f:
-            obj = json.load(f)
+        with open(path, "rb", buffering=IO_BUFFER_SIZE) as f:
+            obj = _loads(f.read())
             if isinstance(obj, dict):
                 yield obj
             elif isinstance(obj, list):
@@ -130,7 +237,7 @@ def read_json_or_jsonl(path: str) -> Iterable[Dict[str, Any]]:
                         yield it
 
 
-def normalize_event(raw: Dict[str, Any], fallback_user: Optional[str], fallback_task: Optional[int]) -> Dict[str, Any]:
+def normalize_event(raw: Dict[str, Any], fallback_user: Optional[str], fallback_task: Optional[int]) -> Event:
     """
     Map your current formats (run/auto_save/ai-help) into one unified schema.
     Missing fields are set to None.
@@ -148,26 +255,37 @@ def normalize_event(raw: Dict[str, Any], fallback_user: Optional[str], fallback_
         task_num = fallback_task
 
     # unified output
-    out: Dict[str, Any] = {k: None for k in UNIFIED_KEYS}
-
-    out["ts"] = raw.get("timestamp") or raw.get("ts") or raw.get("time") or raw.get("occurred_at")
-    out["user_id"] = pad_user_id(user_id) if user_id is not None else None
-    out["username"] = username
-    out["task"] = task_num
-    out["event"] = event_type
-    out["code"] = raw.get("code")
-
-    # run payload
-    out["stdout"] = raw.get("stdout")
-    out["stderr"] = raw.get("stderr")
-
-    # ai_help payload
-    out["estimated_stage"] = raw.get("estimated_stage")
-    out["next_stage"] = raw.get("next_stage")
-    out["processing_structure"] = raw.get("processing_structure")
-    out["advice"] = raw.get("advice")
-
-    return out
+    return Event(
+        ts=raw.get("timestamp") or raw.get("ts") or raw.get("time") or raw.get("occurred_at"),
+        user_id=pad_user_id(user_id) if user_id is not None else None,
+        username=username,
+        task=task_num,
+        event=event_type,
+        code=raw.get("code"),
+        # run payload
+        stdout=raw.get("stdout"),
+        stderr=raw.get("stderr"),
+        # ai_help payload
+        estimated_stage=raw.get("estimated_stage"),
+        next_stage=raw.get("next_stage"),
+        processing_structure=raw.get("processing_structure"),
+        advice=raw.get("advice"),
+    )
+
+
+def encode_events(events: List[Event]) -> List[bytes]:
+    """
+    Encode events as JSONL lines (key order & all keys from UNIFIED_KEYS).
+    One row dict is built up front and overwritten per event, instead of
+    allocating a fresh dict for every row.
+    """
+    row: Dict[str, Any] = dict.fromkeys(UNIFIED_KEYS)
+    update = row.update
+    lines: List[bytes] = []
+    for ev in events:
+        update(zip(UNIFIED_KEYS, ev))
+        lines.append(_dumps(row) + b"\n")
+    return lines
 
 
 def discover_user_task_from_path(path: str) -> Tuple[Optional[str], Optional[int]]:
@@ -175,7 +293,13 @@ def discover_user_task_from_path(path: str) -> Tuple[Optional[str], Optional[int
     Try to infer (user_id, task_num) from directory structure:
     .../user_001/task_14/xxx.json  -> ('user_001', 14)
     """
-    parts = os.path.normpath(path).split(os.sep)
+    # only the directories matter, and many files share one
+    return _discover_from_dir(os.path.dirname(path))
+
+
+@lru_cache(maxsize=None)
+def _discover_from_dir(dirname: str) -> Tuple[Optional[str], Optional[int]]:
+    parts = os.path.normpath(dirname).split(os.sep)
     user_id = None
     task_num = None
     for p in parts:
@@ -189,13 +313,28 @@ def discover_user_task_from_path(path: str) -> Tuple[Optional[str], Optional[int
 
 
 def iter_input_files(root: str) -> Iterable[str]:
-    for dirpath, _, filenames in os.walk(root):
-        for fn in filenames:
+    """
+    Recursively yield .json/.jsonl files under root (top-down, like os.walk).
+    Uses os.scandir so file/dir checks come from the cached dir entry.
+    """
+    try:
+        it = os.scandir(root)
+    except OSError:
+        return
+    subdirs: List[str] = []
+    with it:
+        for entry in it:
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    subdirs.append(entry.path)
+                continue
+            fn = entry.name
             if fn.startswith("."):
                 continue
-            low = fn.lower()
-            if low.endswith(".json") or low.endswith(".jsonl"):
-                yield os.path.join(dirpath, fn)
+            if fn.lower().endswith((".json", ".jsonl")):
+                yield entry.path
+    for d in subdirs:
+        yield from iter_input_files(d)
 
 
 def main() -> None:
@@ -210,7 +349,7 @@ def main() -> None:
     out_dir = args.out_dir
 
     # Collect events per (user_id, task)
-    buckets: Dict[Tuple[str, int], List[Dict[str, Any]]] = defaultdict(list)
+    buckets: Dict[Tuple[str, int], List[Event]] = defaultdict(list)
 
     for fp in iter_input_files(in_dir):
         fb_user, fb_task = discover_user_task_from_path(fp)
@@ -218,27 +357,30 @@ def main() -> None:
             ev = normalize_event(raw, fallback_user=fb_user, fallback_task=fb_task)
 
             # Skip if we still can't identify user/task
-            if not ev.get("user_id") or ev.get("task") is None:
+            if not ev.user_id or ev.task is None:
                 continue
 
-            buckets[(ev["user_id"], int(ev["task"]))].append(ev)
+            buckets[(ev.user_id, int(ev.task))].append(ev)
+
+    # Create each user folder once (not once per task)
+    user_folders: Dict[str, str] = {}
+    for user_id, _ in buckets:
+        if user_id not in user_folders:
+            user_folders[user_id] = os.path.join(out_dir, user_id)
+            os.makedirs(user_folders[user_id], exist_ok=True)
 
     # Write outputs
     for (user_id, task_num), events in buckets.items():
         if args.sort:
-            events.sort(key=lambda e: (parse_iso_ts(e.get("ts")) or datetime.min))
-
-        user_folder = os.path.join(out_dir, user_id)
-        os.makedirs(user_folder, exist_ok=True)
+            events.sort(key=lambda e: ts_sort_key(e.ts))
 
-        out_path = os.path.join(user_folder, filename_user_task(user_id, task_num))
-        mode = "a" if args.append else "w"
+        out_path = os.path.join(user_folders[user_id], filename_user_task(user_id, task_num))
+        mode = "ab" if args.append else "wb"
 
-        with open(out_path, mode, encoding="utf-8") as f:
-            for ev in events:
-                # ensure key order & always all keys
-                row = {k: ev.get(k, None) for k in UNIFIED_KEYS}
-                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        with open(out_path, mode, buffering=IO_BUFFER_SIZE) as f:
+            # encode in batches and hand each batch to writelines() at once
+            for start in range(0, len(events), WRITE_BATCH_SIZE):
+                f.writelines(encode_events(events[start:start + WRITE_BATCH_SIZE]))
 
     print(f"Done. Wrote {len(buckets)} file(s) under: {out_dir}")
 
@@ -2,10 +2,16 @@
 # -*- coding: utf-8 -*-
 
 import argparse
-import csv
 import json
 import os
-from typing import Any, Dict, Iterable
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Any, Dict, Iterable, Iterator, List
+
+try:
+    import orjson
+except ImportError:  # fall back to stdlib json
+    orjson = None
 
 UNIFIED_KEYS = [
     "ts",
@@ -25,76 +31,172 @@ UNIFIED_KEYS = [
 JSON_STRINGIFY_FIELDS = {"processing_structure", "advice"}
 
 
-def iter_jsonl(path: str) -> Iterable[Dict[str, Any]]:
-    with open(path, "r", encoding="utf-8") as f:
-        for i, line in enumerate(f, 1):
-            line = line.strip()
-            if not line:
+if orjson is not None:
+    _loads = orjson.loads
+
+    def _dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode("utf-8")
+else:
+    _loads = json.loads
+    # json.dumps() with non-default options builds a new encoder per call;
+    # compact separators match orjson, so output doesn't depend on which is installed
+    _json_encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+    def _dumps(obj: Any) -> str:
+        return _json_encode(obj)
+
+
+# Files up to this size are read in one go and split; larger ones are
+# scanned in fixed-size chunks so memory stays bounded.
+WHOLE_READ_LIMIT = 64 << 20
+READ_CHUNK_SIZE = 1 << 20
+# Buffer size for file reads/writes (default is 8 KiB).
+IO_BUFFER_SIZE = 1 << 20
+
+
+def iter_raw_lines(path: str) -> Iterator[bytes]:
+    """Yield the lines of a file as bytes (without the trailing newline)."""
+    with open(path, "rb", buffering=IO_BUFFER_SIZE) as f:
+        if os.fstat(f.fileno()).st_size <= WHOLE_READ_LIMIT:
+            yield from f.read().split(b"\n")
+            return
+        # keep the unterminated tail as a list of chunks so a very long line
+        # is joined once instead of being re-copied on every read
+        pending: List[bytes] = []
+        while True:
+            chunk = f.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            cut = chunk.rfind(b"\n")
+            if cut < 0:
+                pending.append(chunk)
                 continue
-            try:
-                obj = json.loads(line)
-            except json.JSONDecodeError as e:
-                raise RuntimeError(f"JSONL parse error: {path}:{i}: {e}") from e
-            if isinstance(obj, dict):
-                yield obj
+            pending.append(chunk[:cut])
+            yield from b"".join(pending).split(b"\n")
+            pending = [chunk[cut + 1:]]
+        if pending:
+            yield b"".join(pending)
 
 
-def ensure_row(obj: Dict[str, Any]) -> Dict[str, Any]:
-    row: Dict[str, Any] = {}
+def iter_jsonl(path: str) -> Iterable[Dict[str, Any]]:
+    for i, line in enumerate(iter_raw_lines(path), 1):
+        if not line or line.isspace():
+            continue
+        try:
+            obj = _loads(line)
+        except json.JSONDecodeError as e:
+            raise RuntimeError(f"JSONL parse error: {path}:{i}: {e}") from e
+        if isinstance(obj, dict):
+            yield obj
+
+
+def ensure_row(obj: Dict[str, Any]) -> List[Any]:
+    """Return the CSV row for obj as a list in UNIFIED_KEYS order."""
+    row: List[Any] = []
     for k in UNIFIED_KEYS:
         v = obj.get(k, None)
 
-        if k in JSON_STRINGIFY_FIELDS and v is not None:
-            v = json.dumps(v, ensure_ascii=False)
-
         if v is None:
             v = ""
+        elif k in JSON_STRINGIFY_FIELDS:
+            v = _dumps(v)
 
-        row[k] = v
+        row.append(v)
     return row
 
 
+def to_csv_line(row: List[Any], delimiter: str) -> bytes:
+    """
+    Format one CSV line the way csv.writer does by default (QUOTE_MINIMAL,
+    '\r\n' line ends). Fields without special characters are joined as-is,
+    so only the rare field with a delimiter/quote/newline pays for escaping.
+    """
+    parts: List[str] = []
+    for v in row:
+        s = v if isinstance(v, str) else str(v)
+        if delimiter in s or '"' in s or "\n" in s or "\r" in s:
+            s = '"' + s.replace('"', '""') + '"'
+        parts.append(s)
+    return (delimiter.join(parts) + "\r\n").encode("utf-8")
+
+
 def iter_files(root: str) -> Iterable[str]:
-    for dirpath, _, filenames in os.walk(root):
-        for fn in filenames:
+    # os.scandir: file/dir checks come from the cached dir entry (no extra stat)
+    try:
+        it = os.scandir(root)
+    except OSError:
+        return
+    subdirs: List[str] = []
+    with it:
+        for entry in it:
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    subdirs.append(entry.path)
+                continue
+            fn = entry.name
             if fn.startswith("."):
                 continue
             if fn.lower().endswith(".jsonl"):
-                yield os.path.join(dirpath, fn)
+                yield entry.path
+    for d in subdirs:
+        yield from iter_files(d)
 
 
 def to_out_path(in_path: str, in_root: str, out_root: str) -> str:
-    rel = os.path.relpath(in_path, in_root)
+    # iter_files() builds paths as in_root + sep + ..., so slicing off that
+    # prefix is enough; relpath (abspath + split of both sides) is the fallback
+    prefix = os.path.join(in_root, "")
+    if in_path.startswith(prefix):
+        rel = in_path[len(prefix):]
+    else:
+        rel = os.path.relpath(in_path, in_root)
     base, _ = os.path.splitext(rel)
     return os.path.join(out_root, base + ".csv")
 
 
+def convert_one(fp: str, in_root: str, out_root: str, delimiter: str) -> int:
+    """Convert one JSONL file to CSV and return the number of rows written."""
+    out_path = to_out_path(fp, in_root, out_root)
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+
+    count_rows = 0
+    with open(out_path, "wb", buffering=IO_BUFFER_SIZE) as wf:
+        wf.write(to_csv_line(UNIFIED_KEYS, delimiter))
+
+        for obj in iter_jsonl(fp):
+            wf.write(to_csv_line(ensure_row(obj), delimiter))
+            count_rows += 1
+
+    return count_rows
+
+
 def main() -> None:
     ap = argparse.ArgumentParser()
     ap.add_argument("--in", dest="in_dir", required=True, help="input dir (log_jsonl)")
     ap.add_argument("--out", dest="out_dir", required=True, help="output dir (log_csv)")
     ap.add_argument("--delimiter", default=",", help="CSV delimiter (default: ,)")
+    ap.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count, 1 = no pool)")
     args = ap.parse_args()
+    if len(args.delimiter) != 1:
+        ap.error("--delimiter must be a single character")
+    if args.workers is not None and args.workers < 1:
+        ap.error("--workers must be at least 1")
 
     in_dir = args.in_dir
     out_dir = args.out_dir
 
-    count_files = 0
-    count_rows = 0
-
-    for fp in iter_files(in_dir):
-        out_path = to_out_path(fp, in_dir, out_dir)
-        os.makedirs(os.path.dirname(out_path), exist_ok=True)
-
-        with open(out_path, "w", encoding="utf-8", newline="") as wf:
-            writer = csv.DictWriter(wf, fieldnames=UNIFIED_KEYS, delimiter=args.delimiter)
-            writer.writeheader()
+    files = list(iter_files(in_dir))
+    common = (repeat(in_dir), repeat(out_dir), repeat(args.delimiter))
 
-            for obj in iter_jsonl(fp):
-                writer.writerow(ensure_row(obj))
-                count_rows += 1
+    # files are independent, so convert them in parallel
+    if args.workers == 1:
+        counts = list(map(convert_one, files, *common))
+    else:
+        with ProcessPoolExecutor(max_workers=args.workers) as ex:
+            counts = list(ex.map(convert_one, files, *common, chunksize=4))
 
-        count_files += 1
+    count_files = len(counts)
+    count_rows = sum(counts)
 
     print(f"Done. Converted {count_files} file(s), wrote {count_rows} row(s) into: {out_dir}")
 
@@ -1,11 +1,17 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional
 import os
 import re
 import json
+from functools import lru_cache
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:  # 無ければ標準の json で読む
+    orjson = None
+
 app = FastAPI()
 
 # CORS（Vite devから叩く想定）
@@ -19,8 +25,18 @@ app.add_middleware(
 
 LOG_ROOT = Path(os.environ.get("LOG_ROOT", "/data/log_jsonl"))
 
-USER_DIR_RE = re.compile(r"^user_\d+$")
-TASK_FILE_RE = re.compile(r"^user\d+_task(\d+)\.jsonl$")
+NON_DIGIT_RE = re.compile(r"\D")
+
+_loads = orjson.loads if orjson is not None else json.loads
+
+
+def json_response(payload: Dict[str, Any]) -> Any:
+    """
+    orjson があれば直接 bytes にして返す（FastAPI の jsonable_encoder で全イベントを辿らない）
+    """
+    if orjson is None:
+        return payload
+    return Response(content=orjson.dumps(payload), media_type="application/json")
 
 
 def must_exist_dir(p: Path) -> None:
@@ -28,6 +44,23 @@ def must_exist_dir(p: Path) -> None:
         raise HTTPException(status_code=500, detail=f"LOG_ROOT not found: {str(p)}")
 
 
+def task_num_from_filename(name: str) -> Optional[int]:
+    """
+    "user021_task014.jsonl" -> 14（形式が違えば None）
+    正規表現を使わず、固定の区切りをスライスして読む
+    """
+    if not (name.startswith("user") and name.endswith(".jsonl")):
+        return None
+    i = name.find("_task")
+    if i < 0:
+        return None
+    user_digits = name[4:i]
+    task_digits = name[i + 5:-6]
+    if not (user_digits.isdecimal() and task_digits.isdecimal()):
+        return None
+    return int(task_digits)
+
+
 def normalize_event(obj: Dict[str, Any], idx: int) -> Dict[str, Any]:
     """
     既存ログ（auto_save / run / ai-help）を壊さず、フロントが読みやすいキーに寄せる
@@ -71,23 +104,68 @@ def normalize_event(obj: Dict[str, Any], idx: int) -> Dict[str, Any]:
     }
 
 
+# これ以下のサイズは一括で読んで split、超えるものはチャンク単位で読む
+WHOLE_READ_LIMIT = 64 << 20
+READ_CHUNK_SIZE = 1 << 20
+# 読み込みバッファ（デフォルトは 8 KiB）
+IO_BUFFER_SIZE = 1 << 20
+
+
+def iter_raw_lines(path: Path) -> Iterator[bytes]:
+    """
+    ファイルを bytes の行として返す（末尾の改行は含まない）
+    """
+    with path.open("rb", buffering=IO_BUFFER_SIZE) as f:
+        if os.fstat(f.fileno()).st_size <= WHOLE_READ_LIMIT:
+            yield from f.read().split(b"\n")
+            return
+        # 改行の無い末尾はチャンクのリストで持ち、長い行でも join は一度だけにする
+        pending: List[bytes] = []
+        while True:
+            chunk = f.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            cut = chunk.rfind(b"\n")
+            if cut < 0:
+                pending.append(chunk)
+                continue
+            pending.append(chunk[:cut])
+            yield from b"".join(pending).split(b"\n")
+            pending = [chunk[cut + 1:]]
+        if pending:
+            yield b"".join(pending)
+
+
 def read_jsonl_events(path: Path) -> List[Dict[str, Any]]:
+    """
+    同じファイルへの再リクエストはキャッシュから返す（更新されたら読み直す）
+    """
+    try:
+        st = path.stat()
+    except OSError:
+        return []
+    return _read_jsonl_events_cached(str(path), st.st_mtime_ns, st.st_size)
+
+
+@lru_cache(maxsize=32)
+def _read_jsonl_events_cached(path: str, mtime_ns: int, size: int) -> List[Dict[str, Any]]:
+    # mtime_ns / size はキャッシュキー用（ファイルが変われば別エントリになる）
     events: List[Dict[str, Any]] = []
-    if not path.exists():
-        return events
-    with path.open("r", encoding="utf-8", errors="ignore") as f:
-        idx = 0
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
+    idx = 0
+    for line in iter_raw_lines(Path(path)):
+        if not line or line.isspace():
+            continue
+        try:
+            obj = _loads(line)
+        except Exception:
             try:
-                obj = json.loads(line)
+                # 不正な UTF-8 バイトだけ捨てて読み直す（以前の errors="ignore" と同じ扱い）
+                obj = _loads(line.decode("utf-8", "ignore"))
             except Exception:
                 # 壊れ行は飛ばす（必要ならここでログ出し）
                 continue
-            events.append(normalize_event(obj, idx))
-            idx += 1
+        events.append(normalize_event(obj, idx))
+        idx += 1
     return events
 
 
@@ -99,7 +177,12 @@ def health():
 @app.get("/api/users")
 def users():
     must_exist_dir(LOG_ROOT)
-    dirs = [p.name for p in LOG_ROOT.iterdir() if p.is_dir() and USER_DIR_RE.match(p.name)]
+    # "user_<数字>" のディレクトリだけ（正規表現の代わりに前方一致 + isdecimal）
+    with os.scandir(LOG_ROOT) as it:
+        dirs = [
+            e.name for e in it
+            if e.name.startswith("user_") and e.name[5:].isdecimal() and e.is_dir()
+        ]
     return sorted(dirs)
 
 
@@ -111,13 +194,14 @@ def tasks(user: str):
         raise HTTPException(status_code=404, detail="User not found")
 
     task_nums: List[int] = []
-    for p in user_dir.iterdir():
-        if not p.is_file():
-            continue
-        m = TASK_FILE_RE.match(p.name)
-        if not m:
-            continue
-        task_nums.append(int(m.group(1)))
+    with os.scandir(user_dir) as it:
+        for e in it:
+            if not e.is_file():
+                continue
+            n = task_num_from_filename(e.name)
+            if n is None:
+                continue
+            task_nums.append(n)
 
     task_nums.sort()
     return task_nums
@@ -132,14 +216,14 @@ def events(user: str, task: int):
 
     # user021_task014.jsonl 形式
     # user_021 の数字部分は user021 にしたいので、 user_021 -> user021 を作る
-    user_digits = re.sub(r"\D", "", user)  # "user_021" -> "021"
+    user_digits = NON_DIGIT_RE.sub("", user)  # "user_021" -> "021"
     filename = f"user{user_digits}_task{int(task):03d}.jsonl"
     path = user_dir / filename
 
     evs = read_jsonl_events(path)
-    return {
+    return json_response({
         "user": user,
         "task": task,
         "count": len(evs),
         "events": evs,
-    }
+    })
@@ -9,38 +9,58 @@ import "prismjs/themes/prism.css";
  * 返り値: [{type:'same'|'add'|'del', line:string}]
  */
 function diffLinesLCS(prevText = "", currText = "") {
-  const a = (prevText ?? "").split("\n");
-  const b = (currText ?? "").split("\n");
+  const prevStr = prevText ?? "";
+  const currStr = currText ?? "";
+  const a = prevStr.split("\n");
+
+  // 変化なし（auto_save で多い）は dp を作らずに返す
+  if (prevStr === currStr) return a.map((line) => ({ type: "same", line }));
+
+  const b = currStr.split("\n");
+
+  // 先頭・末尾の共通行は LCS から外して dp 表を小さくする
+  let head = 0;
+  while (head < a.length && head < b.length && a[head] === b[head]) head++;
+  let endA = a.length;
+  let endB = b.length;
+  while (endA > head && endB > head && a[endA - 1] === b[endB - 1]) {
+    endA--;
+    endB--;
+  }
+
+  const out = [];
+  for (let k = 0; k < head; k++) out.push({ type: "same", line: a[k] });
 
-  const n = a.length;
-  const m = b.length;
+  const n = endA - head;
+  const m = endB - head;
 
   const dp = Array.from({ length: n + 1 }, () => new Uint16Array(m + 1));
   for (let i = n - 1; i >= 0; i--) {
     for (let j = m - 1; j >= 0; j--) {
       dp[i][j] =
-        a[i] === b[j] ? dp[i + 1][j + 1] + 1 : Math.max(dp[i + 1][j], dp[i][j + 1]);
+        a[head + i] === b[head + j] ? dp[i + 1][j + 1] + 1 : Math.max(dp[i + 1][j], dp[i][j + 1]);
     }
   }
 
-  const out = [];
   let i = 0,
     j = 0;
   while (i < n && j < m) {
-    if (a[i] === b[j]) {
-      out.push({ type: "same", line: a[i] });
+    if (a[head + i] === b[head + j]) {
+      out.push({ type: "same", line: a[head + i] });
       i++;
       j++;
     } else if (dp[i + 1][j] >= dp[i][j + 1]) {
-      out.push({ type: "del", line: a[i] });
+      out.push({ type: "del", line: a[head + i] });
       i++;
     } else {
-      out.push({ type: "add", line: b[j] });
+      out.push({ type: "add", line: b[head + j] });
       j++;
     }
   }
-  while (i < n) out.push({ type: "del", line: a[i++] });
-  while (j < m) out.push({ type: "add", line: b[j++] });
+  while (i < n) out.push({ type: "del", line: a[head + i++] });
+  while (j < m) out.push({ type: "add", line: b[head + j++] });
+
+  for (let k = endA; k < a.length; k++) out.push({ type: "same", line: a[k] });
 
   return out;
 }